@@ -1,7 +1,6 @@
 import os
+import threading
 from typing import TypedDict, List, Dict, Any
-from langgraph.graph import StateGraph, END
-from langchain_openai import ChatOpenAI
 from langchain_core.messages import BaseMessage, HumanMessage, AIMessage, SystemMessage
 from memory_manager import MemoryManager
 from dotenv import load_dotenv
@@ -16,12 +15,24 @@ class AgentState(TypedDict):
     memory_context: str
     response_text: str
 
-# Initialize the LLM with a slightly higher temperature for empathy
-llm = ChatOpenAI(
-    model="gpt-3.5-turbo", 
-    temperature=0.7,
-    api_key=os.getenv("OPENAI_API_KEY")
-)
+# The LLM client and compiled graph are built on first use so importing this module stays cheap
+_llm = None
+_agent_executor = None
+_init_lock = threading.Lock()
+
+def get_llm():
+    global _llm
+    if _llm is None:
+        with _init_lock:
+            if _llm is None:
+                from langchain_openai import ChatOpenAI
+                # Initialize the LLM with a slightly higher temperature for empathy
+                _llm = ChatOpenAI(
+                    model="gpt-3.5-turbo", 
+                    temperature=0.7,
+                    api_key=os.getenv("OPENAI_API_KEY")
+                )
+    return _llm
 
 def retrieve_memories_node(state: AgentState):
     """
@@ -73,7 +84,7 @@ def generate_response_node(state: AgentState):
     
     # Simple retry logic for reliability
     try:
-        response = llm.invoke(llm_messages)
+        response = get_llm().invoke(llm_messages)
         return {"messages": state['messages'] + [response], "response_text": response.content}
     except Exception as e:
         print(f"Error in LLM call: {e}")
@@ -112,7 +123,7 @@ def extract_facts_node(state: AgentState):
     )
     
     try:
-        fact_response = llm.invoke([SystemMessage(content=extraction_prompt)])
+        fact_response = get_llm().invoke([SystemMessage(content=extraction_prompt)])
         fact_text = fact_response.content.strip()
         
         if fact_text.upper() != "NONE":
@@ -125,21 +136,33 @@ def extract_facts_node(state: AgentState):
         print(f"Error extracting facts: {e}")
     return {}
 
-# Define the Graph
-workflow = StateGraph(AgentState)
+def build_agent_executor():
+    from langgraph.graph import StateGraph, END
+
+    # Define the Graph
+    workflow = StateGraph(AgentState)
+
+    # Add Nodes
+    workflow.add_node("retrieve", retrieve_memories_node)
+    workflow.add_node("respond", generate_response_node)
+    workflow.add_node("persist_episodic", update_memory_node)
+    workflow.add_node("persist_semantic", extract_facts_node)
 
-# Add Nodes
-workflow.add_node("retrieve", retrieve_memories_node)
-workflow.add_node("respond", generate_response_node)
-workflow.add_node("persist_episodic", update_memory_node)
-workflow.add_node("persist_semantic", extract_facts_node)
+    # Set up Edges
+    workflow.set_entry_point("retrieve")
+    workflow.add_edge("retrieve", "respond")
+    workflow.add_edge("respond", "persist_episodic")
+    workflow.add_edge("persist_episodic", "persist_semantic")
+    workflow.add_edge("persist_semantic", END)
 
-# Set up Edges
-workflow.set_entry_point("retrieve")
-workflow.add_edge("retrieve", "respond")
-workflow.add_edge("respond", "persist_episodic")
-workflow.add_edge("persist_episodic", "persist_semantic")
-workflow.add_edge("persist_semantic", END)
+    # Compile the final agent
+    return workflow.compile()
 
-# Compile the final agent
-agent_executor = workflow.compile()
+def get_agent_executor():
+    """Returns the compiled agent graph, compiling it on first use."""
+    global _agent_executor
+    if _agent_executor is None:
+        with _init_lock:
+            if _agent_executor is None:
+                _agent_executor = build_agent_executor()
+    return _agent_executor
@@ -0,0 +1,17 @@
+"""
+Recomputes last_message_preview, message_count and last_message_at for every
+conversation. Safe to re-run at any time.
+
+Usage:
+    python backfill_conversation_summaries.py
+"""
+from main import SessionLocal, backfill_conversation_summaries, init_db
+
+if __name__ == "__main__":
+    init_db()
+    db = SessionLocal()
+    try:
+        count = backfill_conversation_summaries(db)
+        print(f"Backfilled summaries for {count} conversations")
+    finally:
+        db.close()
@@ -0,0 +1,137 @@
+"""
+Startup profile benchmark: measures how long a fresh worker takes to import `main`,
+how long until it answers its first request, and its resident memory at that point.
+
+The LLM, LangGraph and ChromaDB clients are deferred to the first /api/chat, so their
+build cost is timed separately (`first_chat_init_seconds`) in a fresh interpreter with
+stub keys and a throwaway Chroma directory. The OpenAI round trips of that first chat
+are network-bound and not included.
+
+Usage:
+    python bench_startup.py                 # 5 runs, prints a JSON summary
+    python bench_startup.py --runs 10 --importtime
+"""
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import tempfile
+import statistics
+import subprocess
+import urllib.request
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def measure_import():
+    """Imports main in a clean interpreter and returns the wall time in seconds."""
+    code = "import time; t = time.perf_counter(); import main; print(time.perf_counter() - t)"
+    out = subprocess.run([sys.executable, "-c", code], cwd=BASE_DIR, capture_output=True, text=True, check=True)
+    return float(out.stdout.strip().splitlines()[-1])
+
+
+def top_imports(limit: int = 15):
+    """Returns the slowest imports (cumulative microseconds) reported by `python -X importtime`."""
+    out = subprocess.run([sys.executable, "-X", "importtime", "-c", "import main"], cwd=BASE_DIR, capture_output=True, text=True)
+    rows = []
+    for line in out.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = [part.strip() for part in line[len("import time:"):].split("|")]
+        rows.append((int(cumulative), name.strip()))
+    rows.sort(reverse=True)
+    return [{"module": name, "cumulative_us": us} for us, name in rows[:limit]]
+
+
+def measure_first_chat_init():
+    """Builds the clients the first /api/chat would build and returns the wall time in seconds."""
+    code = (
+        "import time; t = time.perf_counter()\n"
+        "from agent_logic import get_llm, get_agent_executor\n"
+        "from memory_manager import get_client, get_embedding_function\n"
+        "get_llm(); get_agent_executor(); get_client(); get_embedding_function()\n"
+        "print(time.perf_counter() - t)"
+    )
+    with tempfile.TemporaryDirectory(prefix="chroma_bench_") as chroma_dir:
+        env = {**os.environ, "OPENAI_API_KEY": os.getenv("OPENAI_API_KEY") or "sk-bench", "CHROMA_MODE": "embedded", "CHROMA_DATA_PATH": chroma_dir}
+        out = subprocess.run([sys.executable, "-c", code], cwd=BASE_DIR, env=env, capture_output=True, text=True, check=True)
+    return float(out.stdout.strip().splitlines()[-1])
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def rss_mb(pid: int):
+    """Resident set size of a process in MB (Linux only; None elsewhere)."""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        return None
+    return None
+
+
+def measure_first_request(timeout: float = 60.0):
+    """Starts a uvicorn worker and returns (seconds until the first 200 on /, RSS in MB)."""
+    port = free_port()
+    start = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=BASE_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        while time.perf_counter() - start < timeout:
+            if proc.poll() is not None:
+                raise RuntimeError("uvicorn exited before serving a request")
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/", timeout=1) as resp:
+                    if resp.status == 200:
+                        return time.perf_counter() - start, rss_mb(proc.pid)
+            except OSError:
+                time.sleep(0.02)
+        raise TimeoutError(f"no response within {timeout}s")
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+def summarize(values):
+    values = [v for v in values if v is not None]
+    if not values:
+        return None
+    return {"median": round(statistics.median(values), 4), "min": round(min(values), 4), "max": round(max(values), 4)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--importtime", action="store_true", help="also list the slowest imports")
+    parser.add_argument("--skip-first-chat", action="store_true", help="don't time the deferred client build")
+    args = parser.parse_args()
+
+    import_times, first_request_times, first_chat_times, rss = [], [], [], []
+    for _ in range(args.runs):
+        import_times.append(measure_import())
+        elapsed, mem = measure_first_request()
+        first_request_times.append(elapsed)
+        rss.append(mem)
+        if not args.skip_first_chat:
+            first_chat_times.append(measure_first_chat_init())
+
+    result = {
+        "runs": args.runs,
+        "import_seconds": summarize(import_times),
+        "time_to_first_request_seconds": summarize(first_request_times),
+        "first_chat_init_seconds": summarize(first_chat_times),
+        "rss_mb": summarize(rss),
+    }
+    if args.importtime:
+        result["slowest_imports"] = top_imports()
+    print(json.dumps(result, indent=2))
@@ -0,0 +1,125 @@
+"""
+Consistency check for the shared vector store: N worker processes write to and read
+from one Chroma server concurrently, then every worker verifies it sees every write.
+
+Uses fixed embeddings, so no OpenAI key is needed.
+
+Usage:
+    python check_shared_store.py --workers 4                  # against CHROMA_HOST:CHROMA_PORT
+    python check_shared_store.py --workers 4 --start-server   # spins up a throwaway local server
+"""
+import os
+import sys
+import time
+import uuid
+import shutil
+import socket
+import argparse
+import tempfile
+import subprocess
+import multiprocessing
+
+
+def embedding_for(worker: int, seq: int):
+    return [float(worker), float(seq), 1.0]
+
+
+def run_worker(worker: int, collection_name: str, records: int, workers: int, barrier, results):
+    # Import inside the child so each process builds its own pooled HTTP client
+    from memory_manager import get_client
+
+    try:
+        coll = get_client().get_or_create_collection(name=collection_name, embedding_function=None)
+        barrier.wait()
+
+        for seq in range(records):
+            record_id = f"w{worker}_{seq}"
+            coll.add(ids=[record_id], documents=[f"worker {worker} record {seq}"], embeddings=[embedding_for(worker, seq)])
+            # Read-your-writes: the record must be visible straight after the add
+            got = coll.get(ids=[record_id])
+            if got["ids"] != [record_id]:
+                raise AssertionError(f"worker {worker} could not read back {record_id}")
+
+        barrier.wait()
+
+        expected = {f"w{w}_{s}": f"worker {w} record {s}" for w in range(workers) for s in range(records)}
+        got = coll.get(ids=list(expected))
+        seen = dict(zip(got["ids"], got["documents"]))
+        if seen != expected:
+            missing = sorted(set(expected) - set(seen))
+            raise AssertionError(f"worker {worker} sees {len(seen)}/{len(expected)} records, missing e.g. {missing[:5]}")
+        if coll.count() != len(expected):
+            raise AssertionError(f"worker {worker} counted {coll.count()} records, expected {len(expected)}")
+        results.put((worker, None))
+    except Exception as e:
+        barrier.abort()
+        results.put((worker, f"{type(e).__name__}: {e}"))
+
+
+def start_local_server(port: int):
+    """Starts a throwaway `chroma run` server on a temp directory and waits until it accepts connections."""
+    data_dir = tempfile.mkdtemp(prefix="chroma_check_")
+    proc = subprocess.Popen(
+        ["chroma", "run", "--path", data_dir, "--host", "127.0.0.1", "--port", str(port)],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=1):
+                return proc, data_dir
+        except OSError:
+            time.sleep(0.2)
+    proc.terminate()
+    raise TimeoutError("chroma server did not start within 30s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--records", type=int, default=25, help="records written per worker")
+    parser.add_argument("--start-server", action="store_true", help="run a temporary local Chroma server")
+    args = parser.parse_args()
+
+    os.environ["CHROMA_MODE"] = "http"
+    server = data_dir = None
+    if args.start_server:
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            port = sock.getsockname()[1]
+        os.environ["CHROMA_HOST"] = "127.0.0.1"
+        os.environ["CHROMA_PORT"] = str(port)
+        server, data_dir = start_local_server(port)
+
+    collection_name = f"consistency_check_{uuid.uuid4().hex[:8]}"
+    barrier = multiprocessing.Barrier(args.workers)
+    results = multiprocessing.Queue()
+    procs = [
+        multiprocessing.Process(target=run_worker, args=(w, collection_name, args.records, args.workers, barrier, results))
+        for w in range(args.workers)
+    ]
+    failures = [("-", "did not finish")]
+    try:
+        for p in procs:
+            p.start()
+        outcomes = [results.get(timeout=300) for _ in procs]
+        for p in procs:
+            p.join()
+
+        failures = [(w, err) for w, err in outcomes if err]
+        for w, err in sorted(failures):
+            print(f"FAIL worker {w}: {err}")
+        if not failures:
+            print(f"OK: {args.workers} workers x {args.records} records, all writes visible to every worker")
+    finally:
+        from memory_manager import get_client
+        try:
+            get_client().delete_collection(collection_name)
+        except Exception as e:
+            print(f"Could not delete {collection_name}: {e}")
+        if server:
+            server.terminate()
+            server.wait()
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,78 @@
+import os
+import json
+import asyncio
+import hashlib
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# How long a finished result is replayed for repeated submissions of the same key
+IDEMPOTENCY_TTL_SECONDS = float(os.getenv("IDEMPOTENCY_TTL_SECONDS", 300))
+# How long a worker may hold a key while running it before another worker may take it over
+IDEMPOTENCY_LEASE_SECONDS = float(os.getenv("IDEMPOTENCY_LEASE_SECONDS", 120))
+# How long a retry waits for a run held by another worker before giving up with 409
+IDEMPOTENCY_WAIT_SECONDS = float(os.getenv("IDEMPOTENCY_WAIT_SECONDS", 60))
+IDEMPOTENCY_POLL_SECONDS = 0.25
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+
+
+def request_fingerprint(*parts: Any) -> str:
+    """Hashes the parts of a request that must match for a key to be replayed."""
+    payload = json.dumps(parts, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class IdempotencyKeyReused(Exception):
+    """Raised when a key is reused for a request whose fingerprint differs from the original."""
+
+
+class IdempotencyInProgress(Exception):
+    """Raised when another worker is still running the key after IDEMPOTENCY_WAIT_SECONDS."""
+
+
+class InFlightLeaderCancelled(Exception):
+    """Given to requests that joined a run whose leading request was cancelled."""
+
+
+class InFlightRequests:
+    """
+    Joins concurrent requests for the same key within one worker process: the first caller runs
+    the work and callers arriving while it is in flight await its outcome, provided the request
+    fingerprint matches. Results are not kept here; finished runs are stored in the database so
+    every worker can replay them. Must only be used from the event loop thread.
+    """
+
+    def __init__(self):
+        self._inflight: Dict[Hashable, Tuple[str, asyncio.Future]] = {}
+
+    async def run(self, key: Hashable, fingerprint: str, work: Callable[[], Awaitable[Any]]) -> Any:
+        if key in self._inflight:
+            stored_fingerprint, inflight = self._inflight[key]
+            if stored_fingerprint != fingerprint:
+                raise IdempotencyKeyReused(key)
+            # shield so a follower disconnecting doesn't cancel the leader's run
+            return await asyncio.shield(inflight)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = (fingerprint, future)
+        try:
+            result = await work()
+        except asyncio.CancelledError:
+            # Followers weren't cancelled themselves, so hand them an error they can answer with
+            future.set_exception(InFlightLeaderCancelled(key))
+            future.exception()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Mark the exception as retrieved in case no follower is waiting on it
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            del self._inflight[key]
+
+
+chat_inflight = InFlightRequests()
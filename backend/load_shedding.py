@@ -0,0 +1,237 @@
+import os
+import json
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Tuple
+from dotenv import load_dotenv
+
+load_dotenv()
+
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() in ("1", "true", "yes")
+# Requests handled concurrently by one worker before new ones are rejected with 503
+MAX_IN_FLIGHT = int(os.getenv("MAX_IN_FLIGHT", 64))
+# Number of proxies in front of the app that append to X-Forwarded-For (0 = ignore the header).
+# Clients can prepend anything they like, so the IP is read that many entries from the right.
+TRUSTED_PROXY_HOPS = int(os.getenv("TRUSTED_PROXY_HOPS", 0))
+# Idle (full) buckets are pruned once this many keys are tracked
+MAX_TRACKED_BUCKETS = 10000
+
+
+@dataclass(frozen=True)
+class RateLimitRule:
+    """Token bucket limit applied to requests whose method and path match."""
+    name: str
+    methods: Tuple[str, ...]
+    path: str
+    scope: str  # "user" (JWT subject, falling back to IP) or "ip"
+    capacity: int
+    per_seconds: float
+    prefix: bool = False
+
+    def matches(self, method: str, path: str) -> bool:
+        if method not in self.methods:
+            return False
+        return path.startswith(self.path) if self.prefix else path == self.path
+
+
+class TokenBucket:
+    __slots__ = ("capacity", "refill_per_second", "tokens", "updated_at")
+
+    def __init__(self, capacity: int, refill_per_second: float, now: float):
+        self.capacity = capacity
+        self.refill_per_second = refill_per_second
+        self.tokens = float(capacity)
+        self.updated_at = now
+
+    def refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.refill_per_second)
+        self.updated_at = now
+
+    def wait_time(self, now: float) -> float:
+        """Refills, then returns 0 if a token is available, otherwise seconds until one is."""
+        self.refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.refill_per_second
+
+    def take(self):
+        """Consumes one token; call only after wait_time() returned 0."""
+        self.tokens -= 1
+
+
+class LoadMetrics:
+    """Rolling counters and queue/latency samples for the most recent requests."""
+
+    def __init__(self, samples: int = 1000):
+        self.in_flight = 0
+        self.accepted = 0
+        self.rejected: Dict[str, int] = {}
+        self.queue_ms = deque(maxlen=samples)
+        self.latency_ms = deque(maxlen=samples)
+
+    def reject(self, reason: str):
+        self.rejected[reason] = self.rejected.get(reason, 0) + 1
+
+    @staticmethod
+    def percentiles(values) -> Optional[Dict[str, float]]:
+        if not values:
+            return None
+        ordered = sorted(values)
+        pick = lambda q: round(ordered[min(len(ordered) - 1, int(q * len(ordered)))], 2)
+        return {"p50": pick(0.50), "p90": pick(0.90), "p99": pick(0.99), "max": round(ordered[-1], 2)}
+
+    def snapshot(self) -> Dict:
+        return {
+            "in_flight": self.in_flight,
+            "max_in_flight": MAX_IN_FLIGHT,
+            "accepted": self.accepted,
+            "rejected": dict(self.rejected),
+            "queue_ms": self.percentiles(self.queue_ms),
+            "latency_ms": self.percentiles(self.latency_ms),
+        }
+
+
+def queue_time_ms(header: str, now: float) -> Optional[float]:
+    """
+    Parses an X-Request-Start header ("t=<epoch>" or "<epoch>", in s, ms or us) set by the
+    load balancer and returns how long the request waited before reaching this worker.
+    """
+    try:
+        value = float(header.strip().removeprefix("t="))
+    except ValueError:
+        return None
+    if value > 1e14:
+        value /= 1e6
+    elif value > 1e11:
+        value /= 1e3
+    return max(0.0, (now - value) * 1000)
+
+
+class LoadSheddingMiddleware:
+    """
+    ASGI middleware that rejects work before it reaches a route: 429 when a client's token bucket
+    is empty, 503 when the worker already has MAX_IN_FLIGHT requests running. State is per worker.
+    `skip_rate_limit(path, headers)` may exempt requests that won't cost a route run (e.g. replays)
+    from the token buckets; they still count towards MAX_IN_FLIGHT.
+    """
+
+    def __init__(
+        self,
+        app,
+        rules: List[RateLimitRule],
+        identify_user: Callable[[Optional[str]], Optional[str]],
+        exempt_paths: Tuple[str, ...] = (),
+        metrics: Optional[LoadMetrics] = None,
+        skip_rate_limit: Optional[Callable[[str, Dict[str, str]], bool]] = None,
+    ):
+        self.app = app
+        self.rules = rules
+        self.identify_user = identify_user
+        self.exempt_paths = exempt_paths
+        self.metrics = metrics or LoadMetrics()
+        self.skip_rate_limit = skip_rate_limit
+        self.buckets: Dict[Tuple[str, str], TokenBucket] = {}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not RATE_LIMIT_ENABLED or scope["path"] in self.exempt_paths:
+            await self.app(scope, receive, send)
+            return
+
+        headers = {k.decode("latin-1"): v.decode("latin-1") for k, v in scope["headers"]}
+        if "x-request-start" in headers:
+            waited = queue_time_ms(headers["x-request-start"], time.time())
+            if waited is not None:
+                self.metrics.queue_ms.append(waited)
+
+        if self.metrics.in_flight >= MAX_IN_FLIGHT:
+            self.metrics.reject("overloaded")
+            await self.reject(send, 503, "Server is busy, please retry shortly", 1)
+            return
+
+        retry_after = self.check_rate_limits(scope, headers)
+        if retry_after:
+            await self.reject(send, 429, "Too many requests, please slow down", retry_after)
+            return
+
+        self.metrics.in_flight += 1
+        self.metrics.accepted += 1
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.metrics.in_flight -= 1
+            self.metrics.latency_ms.append((time.perf_counter() - start) * 1000)
+
+    def client_ip(self, scope, headers: Dict[str, str]) -> str:
+        if TRUSTED_PROXY_HOPS:
+            # Repeated X-Forwarded-For headers count as one list, in order
+            forwarded = [
+                part.strip()
+                for k, v in scope["headers"] if k == b"x-forwarded-for"
+                for part in v.decode("latin-1").split(",") if part.strip()
+            ]
+            if len(forwarded) >= TRUSTED_PROXY_HOPS:
+                return forwarded[-TRUSTED_PROXY_HOPS]
+        client = scope.get("client")
+        return client[0] if client else "unknown"
+
+    def check_rate_limits(self, scope, headers: Dict[str, str]) -> float:
+        """
+        Checks every matching rule's bucket and takes a token from each only if all of them allow
+        the request, so a rejected request doesn't drain the other buckets. Returns the longest wait.
+        """
+        method, path = scope["method"], scope["path"]
+        matching = [rule for rule in self.rules if rule.matches(method, path)]
+        if not matching or (self.skip_rate_limit and self.skip_rate_limit(path, headers)):
+            return 0.0
+
+        now = time.monotonic()
+        ip = self.client_ip(scope, headers)
+        user = None
+        retry_after = 0.0
+        buckets = []
+        for rule in matching:
+            if rule.scope == "user":
+                if user is None:
+                    user = self.identify_user(headers.get("authorization"))
+                key = f"user:{user}" if user else f"ip:{ip}"
+            else:
+                key = f"ip:{ip}"
+
+            bucket = self.buckets.get((rule.name, key))
+            if bucket is None:
+                bucket = self.buckets[(rule.name, key)] = TokenBucket(rule.capacity, rule.capacity / rule.per_seconds, now)
+            wait = bucket.wait_time(now)
+            if wait:
+                self.metrics.reject(rule.name)
+                retry_after = max(retry_after, wait)
+            buckets.append(bucket)
+
+        if not retry_after:
+            for bucket in buckets:
+                bucket.take()
+
+        if len(self.buckets) > MAX_TRACKED_BUCKETS:
+            self.prune(now)
+        return retry_after
+
+    def prune(self, now: float):
+        for bucket_key, bucket in list(self.buckets.items()):
+            bucket.refill(now)
+            if bucket.tokens >= bucket.capacity:
+                del self.buckets[bucket_key]
+
+    @staticmethod
+    async def reject(send, status_code: int, detail: str, retry_after: float):
+        body = json.dumps({"detail": detail}).encode("utf-8")
+        await send({
+            "type": "http.response.start",
+            "status": status_code,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(max(1, int(retry_after + 0.999))).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
@@ -1,18 +1,29 @@
-from fastapi import FastAPI, HTTPException, Depends, status, BackgroundTasks
+from fastapi import FastAPI, HTTPException, Depends, Header, status, BackgroundTasks, Request, Response
+from fastapi.concurrency import run_in_threadpool
 from fastapi_mail import FastMail, ConnectionConfig, MessageSchema, MessageType
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from pydantic import BaseModel, EmailStr
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, ForeignKey, JSON
+from sqlalchemy import create_engine, Column, Integer, String, DateTime, ForeignKey, JSON, Index, UniqueConstraint, event, func, update, select, inspect, text
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import sessionmaker, Session, relationship, declarative_base
 from datetime import datetime, timedelta
+from contextlib import asynccontextmanager
+import threading
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 from dotenv import load_dotenv
 import os
-from openai import OpenAI
-from langchain_core.messages import HumanMessage, AIMessage
-from agent_logic import agent_executor
+import json
+import time
+import asyncio
+from settings_cache import settings_cache, SETTINGS_CACHE_REVALIDATE
+from idempotency import (
+    chat_inflight, request_fingerprint, IdempotencyKeyReused, IdempotencyInProgress, InFlightLeaderCancelled,
+    IDEMPOTENCY_KEY_MAX_LENGTH, IDEMPOTENCY_TTL_SECONDS, IDEMPOTENCY_LEASE_SECONDS,
+    IDEMPOTENCY_WAIT_SECONDS, IDEMPOTENCY_POLL_SECONDS
+)
+from load_shedding import LoadSheddingMiddleware, LoadMetrics, RateLimitRule
 
 # Load environment variables from .env file
 load_dotenv()
@@ -21,6 +32,14 @@ load_dotenv()
 SQLALCHEMY_DATABASE_URL = "sqlite:///./cbt_therapy.db"
 engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+@event.listens_for(engine, "connect")
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    # WAL lets readers in other worker processes proceed while one process writes
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA busy_timeout=5000")
+    cursor.close()
 Base = declarative_base()
 
 # JWT settings
@@ -28,6 +47,17 @@ SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-change-in-production")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30 * 24 * 60  # 30 days
 
+# Build the agent graph and vector store client in the background at startup
+# instead of on the first chat request; /api/health/ready reports when it's done
+WARMUP_ON_STARTUP = os.getenv("WARMUP_ON_STARTUP", "false").lower() in ("1", "true", "yes")
+WARMUP_MAX_ATTEMPTS = int(os.getenv("WARMUP_MAX_ATTEMPTS", 5))
+WARMUP_MAX_BACKOFF_SECONDS = 30
+
+# Conversation list settings
+MESSAGE_PREVIEW_LENGTH = 100
+CONVERSATION_PAGE_SIZE = 20
+CONVERSATION_PAGE_SIZE_MAX = 100
+
 # Password hashing
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
@@ -67,11 +97,101 @@ async def send_reset_code_email(email: str, code: str):
         if hasattr(e, 'errors'):
             print(f"Validation Errors: {e.errors()}")
 
-# OpenAI Client
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+# Startup state, reported by the readiness probe
+readiness = {"database": False, "warmed_up": not WARMUP_ON_STARTUP, "warmup_error": None}
+
+def warm_up():
+    """
+    Builds the heavy LLM, LangGraph and ChromaDB clients ahead of the first chat request,
+    retrying with exponential backoff. If every attempt fails the worker is still marked ready
+    (the clients are then built lazily by the first chat request) and the last error stays visible.
+    """
+    import time
+    for attempt in range(1, WARMUP_MAX_ATTEMPTS + 1):
+        try:
+            from agent_logic import get_agent_executor, get_llm
+            from memory_manager import get_client, get_embedding_function
+            get_llm()
+            get_agent_executor()
+            get_client()
+            get_embedding_function()
+            readiness["warmup_error"] = None
+            print("DEBUG: Warm-up finished")
+            break
+        except Exception as e:
+            readiness["warmup_error"] = f"attempt {attempt}/{WARMUP_MAX_ATTEMPTS}: {type(e).__name__}: {e}"
+            print(f"ERROR during warm-up ({readiness['warmup_error']})")
+            if attempt < WARMUP_MAX_ATTEMPTS:
+                time.sleep(min(2 ** (attempt - 1), WARMUP_MAX_BACKOFF_SECONDS))
+    readiness["warmed_up"] = True
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    init_db()
+    readiness["database"] = True
+    if WARMUP_ON_STARTUP:
+        threading.Thread(target=warm_up, name="warm-up", daemon=True).start()
+    yield
 
 # FastAPI app
-app = FastAPI(title="CBT Therapy API", version="1.0.0")
+app = FastAPI(title="CBT Therapy API", version="1.0.0", lifespan=lifespan)
+
+# Rate limits, checked before any route work (each chat costs two LLM calls plus embeddings,
+# and forgot-password queues an email)
+RATE_LIMIT_RULES = [
+    RateLimitRule("chat_user", ("POST",), "/api/chat", "user", capacity=10, per_seconds=60),
+    RateLimitRule("chat_ip", ("POST",), "/api/chat", "ip", capacity=30, per_seconds=60),
+    RateLimitRule("forgot_password_ip", ("POST",), "/api/auth/forgot-password", "ip", capacity=5, per_seconds=15 * 60),
+    RateLimitRule("auth_ip", ("POST",), "/api/auth/", "ip", capacity=20, per_seconds=60, prefix=True),
+]
+# Reset codes sent to one address per window, whichever IPs ask for them. Counted from the
+# reset_codes table so the limit holds across workers.
+FORGOT_PASSWORD_PER_EMAIL = int(os.getenv("FORGOT_PASSWORD_PER_EMAIL", 3))
+FORGOT_PASSWORD_EMAIL_WINDOW = timedelta(hours=1)
+
+def user_id_from_authorization(authorization: str | None) -> str | None:
+    """Reads the user id from a bearer token without touching the database; None if absent or invalid."""
+    if not authorization or not authorization.lower().startswith("bearer "):
+        return None
+    try:
+        payload = jwt.decode(authorization[7:], SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        return None
+    return payload.get("sub")
+
+def is_idempotent_replay(path: str, headers: dict[str, str]) -> bool:
+    """
+    True for a chat whose Idempotency-Key already has a completed or running record: it will be
+    replayed or joined rather than run again, so it shouldn't use up the caller's chat tokens.
+    """
+    key = headers.get("idempotency-key")
+    if path != "/api/chat" or not key:
+        return False
+    user_id = user_id_from_authorization(headers.get("authorization"))
+    if not user_id or not user_id.isdigit():
+        return False
+    db = SessionLocal()
+    try:
+        return db.query(IdempotencyRecord.id).filter(
+            IdempotencyRecord.user_id == int(user_id),
+            IdempotencyRecord.key == key,
+            IdempotencyRecord.status.in_(("completed", "in_progress")),
+            IdempotencyRecord.expires_at > datetime.utcnow()
+        ).first() is not None
+    finally:
+        db.close()
+
+load_metrics = LoadMetrics()
+
+# Load shedding / rate limiting (added before CORS so rejections still carry CORS headers)
+app.add_middleware(
+    LoadSheddingMiddleware,
+    rules=RATE_LIMIT_RULES,
+    identify_user=user_id_from_authorization,
+    exempt_paths=("/", "/api/health/ready", "/api/metrics"),
+    metrics=load_metrics,
+    skip_rate_limit=is_idempotent_replay,
+)
 
 # CORS middleware
 app.add_middleware(
@@ -102,9 +222,17 @@ class Conversation(Base):
     title = Column(String, nullable=False)
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # Denormalized summary, kept in sync by add_chat_message so the list screen needs no message queries
+    last_message_preview = Column(String, nullable=True)
+    message_count = Column(Integer, nullable=False, default=0, server_default="0")
+    last_message_at = Column(DateTime, nullable=True)
     
     messages = relationship("ChatMessage", back_populates="conversation", cascade="all, delete-orphan")
 
+    __table_args__ = (
+        Index("ix_conversations_user_id_updated_at", "user_id", "updated_at"),
+    )
+
 class ChatMessage(Base):
     __tablename__ = "chat_messages"
     
@@ -144,8 +272,79 @@ class ResetCode(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
     expires_at = Column(DateTime, nullable=False)
 
-# Create tables
-Base.metadata.create_all(bind=engine)
+class IdempotencyRecord(Base):
+    __tablename__ = "idempotency_records"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    key = Column(String, nullable=False)
+    fingerprint = Column(String, nullable=False) # hash of the request body the key was first used with
+    status = Column(String, nullable=False) # 'in_progress', 'completed' or 'failed'
+    conversation_id = Column(Integer, ForeignKey("conversations.id"), nullable=True)
+    user_message_id = Column(Integer, ForeignKey("chat_messages.id"), nullable=True)
+    response = Column(JSON, nullable=True)
+    locked_until = Column(DateTime, nullable=False) # lease held by the worker running the key
+    created_at = Column(DateTime, default=datetime.utcnow)
+    expires_at = Column(DateTime, nullable=False)
+
+    __table_args__ = (
+        UniqueConstraint("user_id", "key", name="uq_idempotency_records_user_id_key"),
+    )
+
+def backfill_conversation_summaries(db: Session) -> int:
+    """Recomputes the denormalized summary columns of every conversation from its messages."""
+    messages = ChatMessage.__table__
+    last_message = (
+        select(messages.c.content)
+        .where(messages.c.conversation_id == Conversation.id)
+        .order_by(messages.c.created_at.desc(), messages.c.id.desc())
+        .limit(1)
+        .scalar_subquery()
+    )
+    result = db.execute(
+        update(Conversation)
+        .values(
+            message_count=select(func.count(messages.c.id)).where(messages.c.conversation_id == Conversation.id).scalar_subquery(),
+            last_message_at=select(func.max(messages.c.created_at)).where(messages.c.conversation_id == Conversation.id).scalar_subquery(),
+            last_message_preview=func.substr(last_message, 1, MESSAGE_PREVIEW_LENGTH),
+            # Keep the activity ordering intact instead of letting onupdate stamp every row
+            updated_at=Conversation.updated_at,
+        )
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
+    return result.rowcount
+
+def migrate_conversation_summary_columns():
+    """Adds the summary columns and index to a pre-existing conversations table, then backfills them."""
+    existing = {col["name"] for col in inspect(engine).get_columns("conversations")}
+    missing = [
+        (name, ddl) for name, ddl in (
+            ("last_message_preview", "VARCHAR"),
+            ("message_count", "INTEGER NOT NULL DEFAULT 0"),
+            ("last_message_at", "DATETIME"),
+        ) if name not in existing
+    ]
+    if not missing:
+        return
+
+    with engine.begin() as conn:
+        for name, ddl in missing:
+            conn.execute(text(f"ALTER TABLE conversations ADD COLUMN {name} {ddl}"))
+    for index in Conversation.__table__.indexes:
+        index.create(bind=engine, checkfirst=True)
+
+    db = SessionLocal()
+    try:
+        count = backfill_conversation_summaries(db)
+        print(f"DEBUG: Backfilled summaries for {count} conversations")
+    finally:
+        db.close()
+
+def init_db():
+    """Creates missing tables and applies in-place migrations. Runs once per worker at startup."""
+    Base.metadata.create_all(bind=engine)
+    migrate_conversation_summary_columns()
 
 # Pydantic models
 class UserSignup(BaseModel):
@@ -178,6 +377,11 @@ class ConversationResponse(BaseModel):
     class Config:
         from_attributes = True
 
+class ConversationSummaryResponse(ConversationResponse):
+    last_message_preview: str | None = None
+    message_count: int = 0
+    last_message_at: datetime | None = None
+
 class SettingsResponse(BaseModel):
     settings_data: dict
     user_email: str
@@ -264,11 +468,45 @@ def get_current_user(
         raise credentials_exception
     return user
 
+def add_chat_message(db: Session, user_id: int, conversation_id: int | None, role: str, content: str) -> ChatMessage:
+    """
+    Stages a new message and bumps its conversation's denormalized summary.
+    Both writes land in the caller's transaction, so they commit (or roll back) together.
+    """
+    now = datetime.utcnow()
+    msg = ChatMessage(user_id=user_id, conversation_id=conversation_id, role=role, content=content, created_at=now)
+    db.add(msg)
+    if conversation_id:
+        db.execute(
+            update(Conversation)
+            .where(Conversation.id == conversation_id)
+            .values(
+                message_count=Conversation.message_count + 1,
+                last_message_preview=content[:MESSAGE_PREVIEW_LENGTH],
+                last_message_at=now,
+                updated_at=now,
+            )
+            .execution_options(synchronize_session=False)
+        )
+    return msg
+
 # Routes
 @app.get("/")
 def root():
     return {"message": "CBT Therapy API"}
 
+@app.get("/api/health/ready")
+def readiness_check(response: Response):
+    ready = readiness["database"] and readiness["warmed_up"]
+    if not ready:
+        response.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    return {"ready": ready, **readiness}
+
+@app.get("/api/metrics")
+def load_metrics_snapshot():
+    # Per-worker in-flight count, rejections and queue-time/latency percentiles
+    return load_metrics.snapshot()
+
 @app.post("/api/auth/signup", response_model=Token, status_code=status.HTTP_201_CREATED)
 def signup(user_data: UserSignup, db: Session = Depends(get_db)):
     # Check if user already exists
@@ -344,6 +582,14 @@ async def forgot_password(request: ForgotPasswordRequest, background_tasks: Back
     if not user:
         # For security, don't reveal if user exists. 
         return {"message": "If your email is registered, you will receive a code."}
+
+    recent_codes = db.query(func.count(ResetCode.id)).filter(
+        func.lower(func.trim(ResetCode.email)) == request.email.strip().lower(),
+        ResetCode.created_at >= datetime.utcnow() - FORGOT_PASSWORD_EMAIL_WINDOW,
+    ).scalar()
+    if recent_codes >= FORGOT_PASSWORD_PER_EMAIL:
+        # Same answer as a sent code, so the limit doesn't tell the caller anything
+        return {"message": "Verification code sent to email"}
     
     # Generate 4-digit code
     import random
@@ -409,6 +655,12 @@ def reset_password(request: ResetPasswordRequest, db: Session = Depends(get_db))
 def get_conversations(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     return db.query(Conversation).filter(Conversation.user_id == current_user.id).order_by(Conversation.updated_at.desc()).all()
 
+@app.get("/api/chat/conversations/summary", response_model=list[ConversationSummaryResponse])
+def get_conversation_summaries(limit: int = CONVERSATION_PAGE_SIZE, offset: int = 0, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+    # Served entirely from the (user_id, updated_at) index; previews and counts are denormalized
+    limit = max(1, min(limit, CONVERSATION_PAGE_SIZE_MAX))
+    return db.query(Conversation).filter(Conversation.user_id == current_user.id).order_by(Conversation.updated_at.desc(), Conversation.id.desc()).offset(max(offset, 0)).limit(limit).all()
+
 @app.post("/api/chat/conversations", response_model=ConversationResponse)
 def create_conversation(conv_data: ConversationCreate, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     new_conv = Conversation(user_id=current_user.id, title=conv_data.title)
@@ -446,35 +698,132 @@ def get_chat_history(current_user: User = Depends(get_current_user), db: Session
 
 
 @app.post("/api/chat")
-async def chat_endpoint(request: ChatRequest, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+async def chat_endpoint(
+    request: ChatRequest,
+    idempotency_key: str | None = Header(None),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    if not idempotency_key:
+        return await process_chat(request, current_user, db)
+    if len(idempotency_key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+        raise HTTPException(status_code=400, detail=f"Idempotency-Key must be at most {IDEMPOTENCY_KEY_MAX_LENGTH} characters")
+
+    # Retries carrying the same key join the in-flight run (in this worker, or via the
+    # idempotency_records table across workers) or replay its stored result, instead of
+    # saving a duplicate message and running the agent again
+    fingerprint = request_fingerprint(request.message, request.conversation_id)
     try:
-        # Get or create conversation
-        conversation_id = request.conversation_id
-        if not conversation_id:
-            # Always create a NEW conversation if no ID is provided
-            # This prevents today's chats from being mixed into yesterday's history items
-            new_conv = Conversation(user_id=current_user.id, title="New Chat")
-            db.add(new_conv)
+        return await chat_inflight.run(
+            (current_user.id, idempotency_key),
+            fingerprint,
+            lambda: process_chat(request, current_user, db, idempotency_key, fingerprint)
+        )
+    except IdempotencyKeyReused:
+        raise HTTPException(status_code=422, detail="Idempotency-Key was already used for a different message")
+    except IdempotencyInProgress:
+        raise HTTPException(status_code=409, detail="A request with this Idempotency-Key is still being processed")
+    except InFlightLeaderCancelled:
+        raise HTTPException(status_code=503, detail="The original request was interrupted, please retry")
+
+async def claim_idempotency_record(db: Session, user_id: int, key: str, fingerprint: str):
+    """
+    Returns (record, None) when this request should run the chat, with the record leased to it,
+    or (None, response) when a finished run can be replayed. While another worker holds the
+    lease it polls until that run finishes, the lease lapses, or IDEMPOTENCY_WAIT_SECONDS pass.
+    """
+    deadline = time.monotonic() + IDEMPOTENCY_WAIT_SECONDS
+    while True:
+        now = datetime.utcnow()
+        record = db.query(IdempotencyRecord).filter(IdempotencyRecord.user_id == user_id, IdempotencyRecord.key == key).first()
+        if record is not None and record.expires_at <= now:
+            db.delete(record)
             db.commit()
-            db.refresh(new_conv)
-            conversation_id = new_conv.id
-        else:
-            # Update the last activity time for existing conversation
-            conv = db.query(Conversation).filter(Conversation.id == conversation_id).first()
-            if conv:
-                conv.updated_at = datetime.utcnow()
+            record = None
+
+        if record is None:
+            # Opportunistically drop this user's other expired keys
+            db.query(IdempotencyRecord).filter(
+                IdempotencyRecord.user_id == user_id, IdempotencyRecord.expires_at <= now
+            ).delete(synchronize_session=False)
+            record = IdempotencyRecord(
+                user_id=user_id, key=key, fingerprint=fingerprint, status="in_progress",
+                locked_until=now + timedelta(seconds=IDEMPOTENCY_LEASE_SECONDS),
+                expires_at=now + timedelta(seconds=IDEMPOTENCY_TTL_SECONDS)
+            )
+            db.add(record)
+            try:
                 db.commit()
+                return record, None
+            except IntegrityError:
+                # Another worker inserted the key first; re-read it
+                db.rollback()
+                continue
+
+        if record.fingerprint != fingerprint:
+            raise IdempotencyKeyReused(key)
+        if record.status == "completed":
+            return None, record.response
+
+        if record.status == "failed" or record.locked_until <= now:
+            # Take over a failed or abandoned run; the conditional update makes sure only one worker does
+            claimed = db.query(IdempotencyRecord).filter(
+                IdempotencyRecord.id == record.id,
+                IdempotencyRecord.status == record.status,
+                IdempotencyRecord.locked_until == record.locked_until
+            ).update(
+                {"status": "in_progress", "locked_until": now + timedelta(seconds=IDEMPOTENCY_LEASE_SECONDS)},
+                synchronize_session=False
+            )
+            db.commit()
+            if claimed:
+                db.refresh(record)
+                return record, None
+            continue
+
+        if time.monotonic() >= deadline:
+            raise IdempotencyInProgress(key)
+        # End the read transaction so the next poll sees the other worker's commits
+        db.rollback()
+        await asyncio.sleep(IDEMPOTENCY_POLL_SECONDS)
 
-        # Save user message
-        user_msg = ChatMessage(user_id=current_user.id, conversation_id=conversation_id, role="user", content=request.message)
-        db.add(user_msg)
-        db.commit()
+async def process_chat(request: ChatRequest, current_user: User, db: Session, idempotency_key: str | None = None, fingerprint: str | None = None):
+    record = None
+    try:
+        if idempotency_key:
+            record, stored_response = await claim_idempotency_record(db, current_user.id, idempotency_key, fingerprint)
+            if record is None:
+                return stored_response
+
+        if record is not None and record.user_message_id:
+            # An earlier attempt with this key already saved the user message; resume instead of saving it again
+            conversation_id = record.conversation_id
+        else:
+            # Get or create conversation
+            conversation_id = request.conversation_id
+            if not conversation_id:
+                # Always create a NEW conversation if no ID is provided
+                # This prevents today's chats from being mixed into yesterday's history items
+                new_conv = Conversation(user_id=current_user.id, title="New Chat")
+                db.add(new_conv)
+                db.flush()
+                conversation_id = new_conv.id
+
+            # Save user message (also bumps the conversation's last activity time)
+            user_msg = add_chat_message(db, current_user.id, conversation_id, "user", request.message)
+            if record is not None:
+                # Recorded in the same transaction, so a retry after a failure never saves it twice
+                db.flush()
+                record.conversation_id = conversation_id
+                record.user_message_id = user_msg.id
+            db.commit()
 
         # Prepare history context for the LangGraph agent
         # We take the last 10 messages from the conversation history
         history_msgs = db.query(ChatMessage).filter(ChatMessage.conversation_id == conversation_id).order_by(ChatMessage.created_at.desc()).limit(11).all()
         history_msgs.reverse()
         
+        from langchain_core.messages import HumanMessage, AIMessage
         langchain_messages = []
         for msg in history_msgs:
             if msg.role == "user":
@@ -487,16 +836,22 @@ async def chat_endpoint(request: ChatRequest, current_user: User = Depends(get_c
         else:
             # Run the core ReAct agent with Episodic/Semantic memory
             # The agent_executor handles retrieval, response generation, and episodic persistence
-            agent_result = agent_executor.invoke({
+            from agent_logic import get_agent_executor
+            # Run off the event loop (including the first-use graph build) so other requests
+            # and joined retries aren't blocked meanwhile
+            agent_result = await run_in_threadpool(lambda: get_agent_executor().invoke({
                 "messages": langchain_messages,
                 "user_id": current_user.id,
                 "conversation_id": conversation_id
-            })
+            }))
             response_text = agent_result["response_text"]
         
-        # Save AI response
-        ai_msg = ChatMessage(user_id=current_user.id, conversation_id=conversation_id, role="ai", content=response_text)
-        db.add(ai_msg)
+        # Save AI response (and the replayable result, in the same transaction)
+        result = {"message": response_text, "conversation_id": conversation_id}
+        add_chat_message(db, current_user.id, conversation_id, "ai", response_text)
+        if record is not None:
+            record.status = "completed"
+            record.response = result
         db.commit()
 
         # If this was the first user message in a "New Chat", try to generate a better title
@@ -507,60 +862,137 @@ async def chat_endpoint(request: ChatRequest, current_user: User = Depends(get_c
                 conv.title = request.message[:30] + ("..." if len(request.message) > 30 else "")
                 db.commit()
 
-        return {"message": response_text, "conversation_id": conversation_id}
+        return result
+    except (IdempotencyKeyReused, IdempotencyInProgress):
+        raise
+    except asyncio.CancelledError:
+        db.rollback()
+        if record is not None and record.id is not None:
+            # Release the key right away rather than leaving retries to wait out the lease
+            db.query(IdempotencyRecord).filter(IdempotencyRecord.id == record.id, IdempotencyRecord.status == "in_progress").update(
+                {"status": "failed"}, synchronize_session=False
+            )
+            db.commit()
+        raise
     except Exception as e:
         print(f"Error generating response: {e}")
         db.rollback()
+        if record is not None and record.id is not None:
+            # Release the key so a retry resumes the run (reusing the saved user message)
+            db.query(IdempotencyRecord).filter(IdempotencyRecord.id == record.id, IdempotencyRecord.status == "in_progress").update(
+                {"status": "failed"}, synchronize_session=False
+            )
+            db.commit()
         raise HTTPException(status_code=500, detail=str(e))
 
 
 # User Settings Endpoints
+def load_settings_entry(db: Session, user_id: int) -> dict:
+    """Returns the cached settings entry for a user, reading (or creating) the row on a miss."""
+    entry = settings_cache.get(user_id)
+    if entry is not None:
+        if not SETTINGS_CACHE_REVALIDATE:
+            return entry
+        stored_at = db.query(UserSettings.updated_at).filter(UserSettings.user_id == user_id).scalar()
+        if stored_at == entry["updated_at"]:
+            return entry
+
+    settings = db.query(UserSettings).filter(UserSettings.user_id == user_id).first()
+    if not settings:
+        print(f"DEBUG: Creating default settings for user {user_id}")
+        settings = UserSettings(user_id=user_id, settings_data={})
+        db.add(settings)
+        db.commit()
+        db.refresh(settings)
+    return settings_cache.set(user_id, settings.settings_data or {}, settings.updated_at)
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in candidates or any(tag.removeprefix("W/") == etag for tag in candidates)
+
 @app.get("/api/user/settings", response_model=SettingsResponse)
-def get_user_settings(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+def get_user_settings(request: Request, response: Response, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     try:
-        settings = db.query(UserSettings).filter(UserSettings.user_id == current_user.id).first()
-        if not settings:
-            print(f"DEBUG: Creating default settings for user {current_user.id}")
-            settings = UserSettings(user_id=current_user.id, settings_data={})
-            db.add(settings)
-            db.commit()
-            db.refresh(settings)
-        
+        entry = load_settings_entry(db, current_user.id)
+        if etag_matches(request.headers.get("if-none-match"), entry["etag"]):
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": entry["etag"]})
+
+        response.headers["ETag"] = entry["etag"]
         # Add email dynamically to the response
         return {
-            "settings_data": settings.settings_data,
+            "settings_data": entry["settings_data"],
             "user_email": current_user.email,
-            "updated_at": settings.updated_at
+            "updated_at": entry["updated_at"]
         }
     except Exception as e:
         print(f"ERROR in get_user_settings: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.patch("/api/user/settings", response_model=SettingsResponse)
-def update_user_settings(update: SettingsUpdate, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+def update_user_settings(update_data: SettingsUpdate, response: Response, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     try:
-        print(f"DEBUG: Updating settings for user {current_user.id} with data: {update.settings_data}")
-        settings = db.query(UserSettings).filter(UserSettings.user_id == current_user.id).first()
-        if not settings:
-            print(f"DEBUG: No existing settings found, creating new one")
-            settings = UserSettings(user_id=current_user.id, settings_data=update.settings_data)
-            db.add(settings)
+        print(f"DEBUG: Updating settings for user {current_user.id} with data: {update_data.settings_data}")
+        patch = update_data.settings_data
+        if not patch:
+            entry = load_settings_entry(db, current_user.id)
         else:
-            # Explicitly create a new dict to ensure SQLAlchemy detects the change
-            new_data = dict(settings.settings_data) if settings.settings_data else {}
-            new_data.update(update.settings_data)
-            settings.settings_data = new_data
-            print(f"DEBUG: Merged settings: {settings.settings_data}")
-        
-        db.commit()
-        db.refresh(settings)
-        return settings
+            updated_at = datetime.utcnow()
+            # Every requested key is applied to the stored JSON in place (never from a cached copy,
+            # which another worker may have made stale), so concurrent writes to other keys survive
+            new_value = UserSettings.settings_data
+            quoted = {k: v for k, v in patch.items() if '"' in k}
+            if quoted:
+                # SQLite JSON paths can't escape '"', so these keys go through json_patch instead:
+                # clear them first so object values replace rather than merge. Merge-patch drops null
+                # members, so a None value (or a null nested inside the value) removes that key
+                new_value = func.json_patch(new_value, json.dumps({k: None for k in quoted}))
+                new_value = func.json_patch(new_value, json.dumps(quoted))
+            set_args = []
+            for key, value in patch.items():
+                if key not in quoted:
+                    set_args += [f'$."{key}"', func.json(json.dumps(value))]
+            if set_args:
+                new_value = func.json_set(new_value, *set_args)
+
+            row = db.execute(
+                update(UserSettings)
+                .where(UserSettings.user_id == current_user.id)
+                .values(settings_data=new_value, updated_at=updated_at)
+                .returning(UserSettings.settings_data, UserSettings.updated_at)
+            ).first()
+            if row is None:
+                print(f"DEBUG: No existing settings found, creating new one")
+                settings = UserSettings(user_id=current_user.id, settings_data=patch, updated_at=updated_at)
+                db.add(settings)
+                row = (patch, updated_at)
+            db.commit()
+            entry = settings_cache.set(current_user.id, row[0] or {}, row[1])
+            print(f"DEBUG: Merged settings: {entry['settings_data']}")
+
+        response.headers["ETag"] = entry["etag"]
+        return {
+            "settings_data": entry["settings_data"],
+            "user_email": current_user.email,
+            "updated_at": entry["updated_at"]
+        }
     except Exception as e:
         print(f"ERROR in update_user_settings: {e}")
         db.rollback()
+        settings_cache.invalidate(current_user.id)
         raise HTTPException(status_code=500, detail=str(e))
 
 if __name__ == "__main__":
     import uvicorn
+    from memory_manager import CHROMA_MODE
     port = int(os.getenv("PORT", 8000))
-    uvicorn.run(app, host="0.0.0.0", port=port)
+    workers = int(os.getenv("WEB_CONCURRENCY", 1))
+    if workers > 1:
+        if CHROMA_MODE == "embedded":
+            print("WARNING: CHROMA_MODE=embedded is not safe with several workers; set CHROMA_MODE=http to share a Chroma server")
+        # Migrate once here so the workers don't race each other on ALTER TABLE
+        init_db()
+        uvicorn.run("main:app", host="0.0.0.0", port=port, workers=workers)
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=port)
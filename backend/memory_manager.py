@@ -1,6 +1,5 @@
 import os
-import chromadb
-from chromadb.utils import embedding_functions
+import threading
 from typing import List, Dict
 from dotenv import load_dotenv
 
@@ -9,21 +8,66 @@ load_dotenv()
 # Setup ChromaDB
 # Use an absolute path for safety in distributed environments
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-CHROMA_DATA_PATH = os.path.join(BASE_DIR, "chroma_db")
-os.makedirs(CHROMA_DATA_PATH, exist_ok=True)
+CHROMA_DATA_PATH = os.getenv("CHROMA_DATA_PATH", os.path.join(BASE_DIR, "chroma_db"))
 
-# Initialize standard Chroma client
-client = chromadb.PersistentClient(path=CHROMA_DATA_PATH)
+# "embedded" opens the local chroma_db directory in-process, which only one process can use safely.
+# "http" talks to a shared Chroma server so several uvicorn workers or nodes can share memory.
+CHROMA_MODE = os.getenv("CHROMA_MODE", "embedded").lower()
+CHROMA_HOST = os.getenv("CHROMA_HOST", "localhost")
+CHROMA_PORT = int(os.getenv("CHROMA_PORT", 8001))
+CHROMA_SSL = os.getenv("CHROMA_SSL", "false").lower() in ("1", "true", "yes")
+# Size of the keep-alive connection pool shared by all requests in a worker
+CHROMA_HTTP_MAX_CONNECTIONS = int(os.getenv("CHROMA_HTTP_MAX_CONNECTIONS", 20))
 
-# Use OpenAI embeddings for high-quality retrieval
-openai_ef = embedding_functions.OpenAIEmbeddingFunction(
-    api_key=os.getenv("OPENAI_API_KEY"),
-    model_name="text-embedding-3-small"
-)
+# The Chroma client and embedding function are created on first use so importing this module stays cheap
+_client = None
+_openai_ef = None
+_init_lock = threading.Lock()
+
+def get_client():
+    global _client
+    if _client is None:
+        with _init_lock:
+            if _client is None:
+                import chromadb
+                if CHROMA_MODE == "http":
+                    from chromadb.config import Settings
+                    _client = chromadb.HttpClient(
+                        host=CHROMA_HOST,
+                        port=CHROMA_PORT,
+                        ssl=CHROMA_SSL,
+                        settings=Settings(
+                            chroma_http_max_connections=CHROMA_HTTP_MAX_CONNECTIONS,
+                            chroma_http_max_keepalive_connections=CHROMA_HTTP_MAX_CONNECTIONS,
+                            anonymized_telemetry=False,
+                        )
+                    )
+                elif CHROMA_MODE == "embedded":
+                    os.makedirs(CHROMA_DATA_PATH, exist_ok=True)
+                    # Initialize standard Chroma client
+                    _client = chromadb.PersistentClient(path=CHROMA_DATA_PATH)
+                else:
+                    raise ValueError(f"Unknown CHROMA_MODE '{CHROMA_MODE}', expected 'embedded' or 'http'")
+    return _client
+
+def get_embedding_function():
+    global _openai_ef
+    if _openai_ef is None:
+        with _init_lock:
+            if _openai_ef is None:
+                from chromadb.utils import embedding_functions
+                # Use OpenAI embeddings for high-quality retrieval
+                _openai_ef = embedding_functions.OpenAIEmbeddingFunction(
+                    api_key=os.getenv("OPENAI_API_KEY"),
+                    model_name="text-embedding-3-small"
+                )
+    return _openai_ef
 
 class MemoryManager:
     def __init__(self, user_id: int):
         self.user_id = str(user_id)
+        client = get_client()
+        openai_ef = get_embedding_function()
         # Separate collections per user for privacy and isolation
         self.episodic_coll = client.get_or_create_collection(
             name=f"user_{user_id}_episodic",
@@ -0,0 +1,69 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from datetime import datetime
+from typing import Dict, Optional, Any
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Entries are bounded by a TTL so a stale copy (e.g. a write handled by another
+# worker process) can't be served forever.
+SETTINGS_CACHE_TTL_SECONDS = float(os.getenv("SETTINGS_CACHE_TTL_SECONDS", 60))
+# With several workers, another process may have written the row since it was cached, so each
+# cache hit is checked against the row's updated_at (one indexed lookup) before it is served
+SETTINGS_CACHE_REVALIDATE = os.getenv(
+    "SETTINGS_CACHE_REVALIDATE", str(int(os.getenv("WEB_CONCURRENCY", 1)) > 1)
+).lower() in ("1", "true", "yes")
+
+
+def compute_etag(settings_data: Dict[str, Any], updated_at: datetime | None) -> str:
+    """Builds a strong ETag from the settings payload and its last update time."""
+    payload = json.dumps(settings_data or {}, sort_keys=True, separators=(",", ":"), default=str)
+    stamp = updated_at.isoformat() if updated_at else ""
+    digest = hashlib.sha1(f"{stamp}|{payload}".encode("utf-8")).hexdigest()
+    return f'"{digest}"'
+
+
+class SettingsCache:
+    """
+    Process-local write-through cache for UserSettings rows, keyed by user id.
+    Cached dicts are shared, so callers must build a new dict instead of mutating them.
+    """
+
+    def __init__(self, ttl_seconds: float = SETTINGS_CACHE_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self._entries: Dict[int, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, user_id: int) -> Optional[Dict[str, Any]]:
+        """Returns the cached entry for a user, or None if missing or expired."""
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            if time.monotonic() - entry["cached_at"] > self.ttl_seconds:
+                del self._entries[user_id]
+                return None
+            return entry
+
+    def set(self, user_id: int, settings_data: Dict[str, Any], updated_at: datetime | None) -> Dict[str, Any]:
+        """Stores the latest persisted settings for a user and returns the new entry."""
+        entry = {
+            "settings_data": settings_data,
+            "updated_at": updated_at,
+            "etag": compute_etag(settings_data, updated_at),
+            "cached_at": time.monotonic(),
+        }
+        with self._lock:
+            self._entries[user_id] = entry
+        return entry
+
+    def invalidate(self, user_id: int):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+
+settings_cache = SettingsCache()
@@ -122,6 +122,8 @@ export default function ChatScreen({ navigation, route }) {
       text: inputText.trim(),
       sender: 'user',
       timestamp: new Date(),
+      // Created once per message so any resend of it reaches the backend with the same key
+      idempotencyKey: `${Date.now().toString(36)}-${Math.random().toString(36).slice(2, 10)}`,
     };
 
     setMessages(prev => [...prev, userMessage]);
@@ -148,7 +150,9 @@ export default function ChatScreen({ navigation, route }) {
           method: 'POST',
           headers: {
             'Content-Type': 'application/json',
-            'Authorization': `Bearer ${token}`
+            'Authorization': `Bearer ${token}`,
+            // Duplicate submissions of this message are answered by a single agent run
+            'Idempotency-Key': userMessage.idempotencyKey
           },
           body: JSON.stringify({
             message: userMessage.text,